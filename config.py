@@ -4,7 +4,7 @@
 # @Author: Haozhe Xie
 # @Date:   2023-04-05 20:14:54
 # @Last Modified by: Haozhe Xie
-# @Last Modified at: 2024-03-01 10:11:35
+# @Last Modified at: 2026-10-15 17:58:35
 # @Email:  root@haozhexie.com
 
 from easydict import EasyDict
@@ -24,6 +24,8 @@ cfg.DATASETS.OSM_LAYOUT.DIR                      = "./data/osm"
 cfg.DATASETS.OSM_LAYOUT.IGNORED_CLASSES          = [0]
 cfg.DATASETS.OSM_LAYOUT.N_CLASSES                = 7
 cfg.DATASETS.OSM_LAYOUT.MAX_HEIGHT               = 640
+cfg.DATASETS.OSM_LAYOUT_CODES                    = EasyDict()
+cfg.DATASETS.OSM_LAYOUT_CODES.FILE_PATH          = "./data/osm-codes.npy"
 cfg.DATASETS.GOOGLE_EARTH                        = EasyDict()
 cfg.DATASETS.GOOGLE_EARTH.PIN_MEMORY             = ["hf", "seg"]
 cfg.DATASETS.GOOGLE_EARTH.N_REPEAT               = 1
@@ -150,7 +152,10 @@ cfg.TRAIN.SAMPLER                                = EasyDict()
 cfg.TRAIN.SAMPLER.DATASET                        = "OSM_LAYOUT"
 cfg.TRAIN.SAMPLER.N_EPOCHS                       = 1000
 cfg.TRAIN.SAMPLER.CKPT_SAVE_FREQ                 = 25
+cfg.TRAIN.SAMPLER.LOG_FREQ                       = 50
 cfg.TRAIN.SAMPLER.BATCH_SIZE                     = 10
+cfg.TRAIN.SAMPLER.GRAD_ACCUM_STEPS               = 1
+cfg.TRAIN.SAMPLER.COMPILE                        = False
 cfg.TRAIN.SAMPLER.N_WARMUP_ITERS                 = 7500
 cfg.TRAIN.SAMPLER.LR                             = 2e-4
 cfg.TRAIN.SAMPLER.WEIGHT_DECAY                   = 0
@@ -184,6 +189,7 @@ cfg.TRAIN.GANCRAFT.EMA_N_RAMPUP_ITERS            = 10000
 cfg.TEST                                         = EasyDict()
 cfg.TEST.VQGAN                                   = EasyDict()
 cfg.TEST.VQGAN.DATASET                           = "OSM_LAYOUT"
+cfg.TEST.VQGAN.KEYFRAME_FREQ                     = 1
 cfg.TEST.SAMPLER                                 = EasyDict()
 cfg.TEST.SAMPLER.N_SAMPLES                       = 2
 cfg.TEST.SAMPLER.TEMPERATURES                    = [0.5, 1.0, 2.0]
@@ -4,9 +4,11 @@
 # @Author: Haozhe Xie
 # @Date:   2023-04-10 10:46:37
 # @Last Modified by: Haozhe Xie
-# @Last Modified at: 2023-07-19 13:03:11
+# @Last Modified at: 2026-10-15 17:58:44
 # @Email:  root@haozhexie.com
 
+import concurrent.futures
+import contextlib
 import logging
 import math
 import os
@@ -31,14 +33,28 @@ def train(cfg):
     local_rank = utils.distributed.get_rank()
     vqae = models.vqgan.VQAutoEncoder(cfg)
     sampler = models.sampler.AbsorbingDiffusionSampler(cfg)
+    if cfg.TRAIN.SAMPLER.COMPILE and not hasattr(torch.nn.Module, "compile"):
+        logging.warning("The sampler is not compiled, which requires torch >= 2.2.")
+    elif cfg.TRAIN.SAMPLER.COMPILE:
+        # Compiled in-place so that the keys of the state dict remain unchanged.
+        # The batch size is fixed. Recompilations only happen for the last batch.
+        torch._dynamo.config.cache_size_limit = 16
+        sampler.compile(mode="reduce-overhead", fullgraph=False)
     if torch.cuda.is_available():
         local_rank = torch.distributed.get_rank()
         logging.info("Start running the DDP on rank %d." % local_rank)
         vqae = torch.nn.parallel.DistributedDataParallel(
             vqae.to(local_rank), device_ids=[local_rank]
         )
+        # NOTE: static_graph requires the same set of parameters to be used in the
+        #       same autograd graph in every iteration, which holds for the sampler.
+        #       It is unrelated to the input shape.
         sampler = torch.nn.parallel.DistributedDataParallel(
-            sampler.to(local_rank), device_ids=[local_rank]
+            sampler.to(local_rank),
+            device_ids=[local_rank],
+            bucket_cap_mb=50,
+            gradient_as_bucket_view=True,
+            static_graph=True,
         )
     else:
         vqae.device = torch.device("cpu")
@@ -65,13 +81,21 @@ def train(cfg):
             train_dataset, rank=local_rank, shuffle=True, drop_last=True
         )
 
+    # Keep the workers alive across epochs
+    # NOTE: The options are only accepted by torch < 2.0 if there are workers.
+    worker_kwargs = (
+        {"persistent_workers": True, "prefetch_factor": 2}
+        if cfg.CONST.N_WORKERS > 0
+        else {}
+    )
     train_data_loader = torch.utils.data.DataLoader(
         dataset=train_dataset,
         batch_size=cfg.TRAIN.SAMPLER.BATCH_SIZE,
         num_workers=cfg.CONST.N_WORKERS,
         collate_fn=utils.datasets.collate_fn,
-        pin_memory=False,
+        pin_memory=True,
         sampler=train_sampler,
+        **worker_kwargs,
     )
 
     # Set up optimizers
@@ -80,6 +104,8 @@ def train(cfg):
         lr=cfg.TRAIN.SAMPLER.LR,
         weight_decay=cfg.TRAIN.SAMPLER.WEIGHT_DECAY,
         betas=cfg.TRAIN.SAMPLER.BETAS,
+        # Update all parameters in a single CUDA kernel
+        fused=torch.cuda.is_available(),
     )
 
     # Set up loss functions
@@ -93,9 +119,20 @@ def train(cfg):
         os.makedirs(cfg.DIR.CHECKPOINTS, exist_ok=True)
         # Summary writer
         tb_writer = utils.summary_writer.SummaryWriter(cfg)
+        # Checkpoints are saved in the background. The VQAE is frozen.
+        ckpt_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        ckpt_future = None
+        vqae_state_dict = _get_cpu_state_dict(vqae)
 
     # Training/Testing the network
     n_batches = len(train_data_loader)
+    # The trailing micro-batches of an epoch form a shorter accumulation window
+    n_accum_steps = cfg.TRAIN.SAMPLER.GRAD_ACCUM_STEPS
+    n_steps_per_epoch = math.ceil(n_batches / n_accum_steps)
+    # The GPU time of each batch is measured with CUDA events, which are only
+    # synchronized in the logging iterations.
+    batch_start_event = torch.cuda.Event(enable_timing=True)
+    batch_end_event = torch.cuda.Event(enable_timing=True)
     for epoch_idx in range(init_epoch + 1, cfg.TRAIN.SAMPLER.N_EPOCHS + 1):
         epoch_start_time = time()
         batch_time = utils.average_meter.AverageMeter()
@@ -103,6 +140,8 @@ def train(cfg):
         train_losses = utils.average_meter.AverageMeter(
             ["CodeIndexLoss", "Elbo", "RwElbo"]
         )
+        # The number of the skipped optimizer steps, which is kept on device
+        n_skipped_steps = 0
         # Randomize the DistributedSampler
         if train_sampler:
             train_sampler.set_epoch(epoch_idx)
@@ -111,39 +150,92 @@ def train(cfg):
         for batch_idx, data in enumerate(train_data_loader):
             n_itr = (epoch_idx - 1) * n_batches + batch_idx
             data_time.update(time() - batch_end_time)
-            # Warm up the optimizer
-            if n_itr <= cfg.TRAIN.SAMPLER.N_WARMUP_ITERS:
-                lr = cfg.TRAIN.SAMPLER.LR * n_itr / cfg.TRAIN.SAMPLER.N_WARMUP_ITERS
+            batch_start_event.record()
+            # Warm up the optimizer, where the iterations are counted in optimizer steps
+            n_steps = (epoch_idx - 1) * n_steps_per_epoch + batch_idx // n_accum_steps
+            if n_steps <= cfg.TRAIN.SAMPLER.N_WARMUP_ITERS:
+                lr = cfg.TRAIN.SAMPLER.LR * n_steps / cfg.TRAIN.SAMPLER.N_WARMUP_ITERS
                 for pg in optimizer.param_groups:
                     pg["lr"] = lr
 
-            input = utils.helpers.var_or_cuda(data["img"], vqae.device)
-            with torch.no_grad():
-                _, _, info = vqae.module.encode(input)
-
-            x_0 = info["min_encoding_indices"].reshape(cfg.TRAIN.SAMPLER.BATCH_SIZE, -1)
-            t, pt, x_0_hat_logits, x_0_ignore = sampler(x_0)
-            code_index_loss = ce_loss(x_0_hat_logits, x_0_ignore).sum(1)
-            elbo = code_index_loss / t / pt / (math.log(2) * x_0.size(1))
-            rw_elbo = (
-                (1 - (t / cfg.NETWORK.SAMPLER.TOTAL_STEPS))
-                * code_index_loss
-                / (math.log(2) * x_0.size(1))
-            ).mean()
-            if torch.isnan(rw_elbo).any():
-                logging.warning("Skipping the step with NaN loss")
-                continue
-
-            train_losses.update(
-                [code_index_loss.mean().item(), elbo.mean().item(), rw_elbo.item()]
+            if "codes" in data:
+                # The codebook indexes generated by scripts/vqae_code_generator.py
+                x_0 = utils.helpers.var_or_cuda(data["codes"], vqae.device).long()
+            else:
+                input = utils.helpers.var_or_cuda(data["img"], vqae.device)
+                # The encoder runs in BF16, while the quantizer runs in FP32.
+                with torch.no_grad(), torch.autocast(
+                    device_type="cuda", dtype=torch.bfloat16
+                ):
+                    _, _, info = vqae.module.encode(input)
+
+                x_0 = info["min_encoding_indices"]
+
+            # Convert the losses from nats to bits per token
+            # NOTE: The sequence length is a Python int, which needs no synchronization.
+            elbo_factor = 1.0 / (math.log(2) * x_0.size(1))
+            # Skip the gradient all-reduce for the non-final micro-batches.
+            # NOTE: The forward pass must be included in no_sync() as well.
+            # NOTE: The last micro-batch of an epoch is always synchronized so that
+            #       the gradients are not carried into the next epoch.
+            is_last_batch = batch_idx + 1 == n_batches
+            is_sync_step = (batch_idx + 1) % n_accum_steps == 0 or is_last_batch
+            window_size = min(
+                n_accum_steps, n_batches - batch_idx // n_accum_steps * n_accum_steps
             )
-            sampler.zero_grad()
-            rw_elbo.backward()
-            optimizer.step()
+            with contextlib.nullcontext() if is_sync_step else sampler.no_sync():
+                # BF16 needs no GradScaler. The losses are computed in FP32.
+                with torch.autocast(device_type="cuda", dtype=torch.bfloat16):
+                    t, pt, x_0_hat_logits, x_0_ignore = sampler(x_0)
+
+                code_index_loss = ce_loss(x_0_hat_logits.float(), x_0_ignore).sum(1)
+                code_index_loss_bits = code_index_loss * elbo_factor
+                elbo = code_index_loss_bits / (t * pt)
+                rw_elbo = (
+                    (1.0 - t / cfg.NETWORK.SAMPLER.TOTAL_STEPS) * code_index_loss_bits
+                ).mean()
+                # NOTE: The non-finite losses are handled on device instead of being
+                #       checked on the host, which would synchronize every step.
+                #       They are excluded from the averages with a zero weight.
+                is_finite = torch.isfinite(rw_elbo)
+                # Keep the losses on GPU to avoid the synchronization caused by .item()
+                train_losses.update(
+                    torch.where(
+                        is_finite,
+                        torch.stack(
+                            [code_index_loss.mean(), elbo.mean(), rw_elbo]
+                        ).detach(),
+                        0,
+                    ),
+                    is_finite,
+                )
+                (rw_elbo / window_size).backward()
 
-            batch_time.update(time() - batch_end_time)
+            if is_sync_step:
+                # Skip the update if any of the gradients is non-finite. The gradients
+                # are all-reduced, so that all ranks make the same decision.
+                found_inf = _get_found_inf(optimizer)
+                if optimizer.defaults["fused"]:
+                    # NOTE: Same as GradScaler, the fused Adam skips the update on
+                    #       device, where the step counts are not increased either.
+                    optimizer.found_inf = found_inf
+                    optimizer.step()
+                    del optimizer.found_inf
+                elif not found_inf.item():
+                    # The gradients are on CPU, where no device is synchronized.
+                    optimizer.step()
+
+                n_skipped_steps = n_skipped_steps + found_inf
+                sampler.zero_grad(set_to_none=True)
+
+            batch_end_event.record()
             batch_end_time = time()
-            if utils.distributed.is_master():
+            if (
+                utils.distributed.is_master()
+                and batch_idx % cfg.TRAIN.SAMPLER.LOG_FREQ == 0
+            ):
+                batch_end_event.synchronize()
+                batch_time.update(batch_start_event.elapsed_time(batch_end_event) / 1e3)
                 tb_writer.add_scalars(
                     {
                         "Sampler/Loss/Batch/CodeIndex": train_losses.val(0),
@@ -166,6 +258,12 @@ def train(cfg):
                 )
 
         epoch_end_time = time()
+        n_skipped_steps = int(n_skipped_steps)
+        if n_skipped_steps > 0:
+            logging.warning(
+                "[Epoch %d/%d] %d optimizer steps skipped due to non-finite gradients"
+                % (epoch_idx, cfg.TRAIN.SAMPLER.N_EPOCHS, n_skipped_steps)
+            )
         if utils.distributed.is_master():
             tb_writer.add_scalars(
                 {
@@ -179,7 +277,7 @@ def train(cfg):
                 "[Epoch %d/%d] EpochTime = %.3f (s) train_losses = %s"
                 % (
                     epoch_idx,
-                    cfg.TRAIN.VQGAN.N_EPOCHS,
+                    cfg.TRAIN.SAMPLER.N_EPOCHS,
                     epoch_end_time - epoch_start_time,
                     ["%.4f" % l for l in train_losses.avg()],
                 )
@@ -190,23 +288,69 @@ def train(cfg):
         if utils.distributed.is_master():
             tb_writer.add_images(key_frames, epoch_idx)
             # Save ckeckpoints
-            logging.info("Saved checkpoint to ckpt-last.pth ...")
-            torch.save(
+            # NOTE: The parameters are copied to CPU before returning to training.
+            #       The file I/O runs in the background thread.
+            if ckpt_future is not None:
+                ckpt_future.result()
+
+            ckpt_future = ckpt_executor.submit(
+                _save_checkpoint,
                 {
                     "cfg": cfg,
                     "epoch_index": epoch_idx,
-                    "vqae": vqae.state_dict(),
-                    "sampler": sampler.state_dict(),
+                    "vqae": vqae_state_dict,
+                    "sampler": _get_cpu_state_dict(sampler),
                 },
-                os.path.join(cfg.DIR.CHECKPOINTS, "ckpt-last.pth"),
+                cfg.DIR.CHECKPOINTS,
+                cfg.TRAIN.SAMPLER.CKPT_SAVE_FREQ,
             )
-            if epoch_idx % cfg.TRAIN.SAMPLER.CKPT_SAVE_FREQ == 0:
-                shutil.copy(
-                    os.path.join(cfg.DIR.CHECKPOINTS, "ckpt-last.pth"),
-                    os.path.join(
-                        cfg.DIR.CHECKPOINTS, "ckpt-epoch-%03d.pth" % epoch_idx
-                    ),
-                )
 
     if utils.distributed.is_master():
+        if ckpt_future is not None:
+            ckpt_future.result()
+
+        ckpt_executor.shutdown()
         tb_writer.close()
+
+
+def _get_found_inf(optimizer):
+    grads = [
+        p.grad
+        for pg in optimizer.param_groups
+        for p in pg["params"]
+        if p.grad is not None
+    ]
+    found_inf = torch.zeros(1, device=grads[0].device)
+    if found_inf.is_cuda:
+        # The multi-tensor kernel used by GradScaler, where the scale is 1
+        torch._amp_foreach_non_finite_check_and_unscale_(
+            grads, found_inf, found_inf.new_ones(1)
+        )
+    else:
+        found_inf += any(not torch.isfinite(g).all() for g in grads)
+
+    return found_inf
+
+
+def _get_cpu_state_dict(model):
+    return {k: v.detach().cpu() for k, v in model.state_dict().items()}
+
+
+def _save_checkpoint(checkpoint, ckpt_dir, ckpt_save_freq):
+    ckpt_file_path = os.path.join(ckpt_dir, "ckpt-last.pth")
+    # Write to a new file so that the hard links to the previous checkpoint are kept
+    torch.save(checkpoint, ckpt_file_path + ".tmp")
+    os.replace(ckpt_file_path + ".tmp", ckpt_file_path)
+    logging.info("Saved checkpoint to ckpt-last.pth ...")
+    epoch_idx = checkpoint["epoch_index"]
+    if epoch_idx % ckpt_save_freq != 0:
+        return
+
+    epoch_ckpt_file_path = os.path.join(ckpt_dir, "ckpt-epoch-%03d.pth" % epoch_idx)
+    if os.path.exists(epoch_ckpt_file_path):
+        os.remove(epoch_ckpt_file_path)
+    try:
+        os.link(ckpt_file_path, epoch_ckpt_file_path)
+    except OSError:
+        # Hard links are not supported by some file systems
+        shutil.copy(ckpt_file_path, epoch_ckpt_file_path)
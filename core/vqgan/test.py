@@ -4,7 +4,7 @@
 # @Author: Haozhe Xie
 # @Date:   2023-04-06 09:50:44
 # @Last Modified by: Haozhe Xie
-# @Last Modified at: 2023-07-19 13:03:46
+# @Last Modified at: 2026-10-15 17:47:23
 # @Email:  root@haozhexie.com
 
 import logging
@@ -20,13 +20,18 @@ import utils.helpers
 def test(cfg, test_data_loader=None, vqae=None):
     torch.backends.cudnn.benchmark = True
     if vqae is None:
+        # NOTE: DataParallel is avoided since it replicates the model in every forward.
+        #       When called from train(), the DDP-wrapped model is reused instead.
         vqae = models.vqgan.VQAutoEncoder(cfg)
-        if torch.cuda.is_available():
-            vqae = torch.nn.DataParallel(vqae).cuda()
-            vqae.device = vqae.output_device
+        vqae.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        vqae = vqae.to(vqae.device)
 
         logging.info("Recovering from %s ..." % (cfg.CONST.CKPT))
-        checkpoint = torch.load(cfg.CONST.CKPT)
+        checkpoint = torch.load(cfg.CONST.CKPT, map_location=vqae.device)
+        # The checkpoints are saved from the DDP-wrapped models
+        torch.nn.modules.utils.consume_prefix_in_state_dict_if_present(
+            checkpoint["vqae"], "module."
+        )
         vqae.load_state_dict(checkpoint["vqae"])
 
     if test_data_loader is None:
@@ -66,10 +71,18 @@ def test(cfg, test_data_loader=None, vqae=None):
         with torch.no_grad():
             input = utils.helpers.var_or_cuda(data["img"], vqae.device)
             output = utils.helpers.var_or_cuda(data["img"], vqae.device)
-            pred, quant_loss = vqae(input)
+            with torch.autocast(device_type="cuda", dtype=torch.bfloat16):
+                pred, quant_loss = vqae(input)
+
+            pred, quant_loss = pred.float(), quant_loss.float()
             rec_loss = l1_loss(pred[:, [0]], output[:, [0]])
             smth_loss = smooth_loss(pred[:, [0]], output[:, [0]])
-            seg_loss = ce_loss(pred[:, 1:], torch.argmax(output[:, 1:], dim=1))
+            seg_label = (
+                utils.helpers.var_or_cuda(data["seg_label"], vqae.device).long()
+                if "seg_label" in data
+                else torch.argmax(output[:, 1:], dim=1)
+            )
+            seg_loss = ce_loss(pred[:, 1:], seg_label)
             loss = (
                 rec_loss * cfg.TRAIN.VQGAN.REC_LOSS_FACTOR
                 + smth_loss * cfg.TRAIN.VQGAN.SMOOTH_LOSS_FACTOR
@@ -77,33 +90,33 @@ def test(cfg, test_data_loader=None, vqae=None):
                 + quant_loss
             )
             test_losses.update(
-                [
-                    rec_loss.item(),
-                    smth_loss.item(),
-                    seg_loss.item(),
-                    quant_loss.item(),
-                    loss.item(),
-                ]
+                torch.stack([rec_loss, smth_loss, seg_loss, quant_loss, loss])
             )
 
-            key_frames[
-                "VQGAN/Image/%04d/HeightField" % idx
-            ] = utils.helpers.tensor_to_image(
-                torch.cat([pred[:, 0], output[:, 0]], dim=2), "HeightField"
-            )
-            key_frames["VQGAN/Image/%04d/SegMap" % idx] = utils.helpers.tensor_to_image(
-                utils.helpers.onehot_to_mask(
-                    torch.cat(
-                        [
-                            pred[:, 1:],
-                            output[:, 1:],
-                        ],
-                        dim=3,
-                    ),
-                    cfg.DATASETS.OSM_LAYOUT.IGNORED_CLASSES,
-                ),
-                "SegMap",
-            )
+            # Materialize the images every KEYFRAME_FREQ test samples
+            # (all samples by default)
+            if idx % cfg.TEST.VQGAN.KEYFRAME_FREQ == 0:
+                key_frames["VQGAN/Image/%04d/HeightField" % idx] = (
+                    utils.helpers.tensor_to_image(
+                        torch.cat([pred[:, 0], output[:, 0]], dim=2), "HeightField"
+                    )
+                )
+                key_frames["VQGAN/Image/%04d/SegMap" % idx] = (
+                    utils.helpers.tensor_to_image(
+                        utils.helpers.onehot_to_mask(
+                            torch.cat(
+                                [
+                                    pred[:, 1:],
+                                    output[:, 1:],
+                                ],
+                                dim=3,
+                            ),
+                            cfg.DATASETS.OSM_LAYOUT.IGNORED_CLASSES,
+                        ),
+                        "SegMap",
+                    )
+                )
+
             logging.info(
                 "Test[%d/%d] Losses = %s"
                 % (idx + 1, n_samples, ["%.4f" % l for l in test_losses.val()])
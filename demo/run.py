@@ -4,7 +4,7 @@
 # @Author: Haozhe Xie
 # @Date:   2023-06-30 10:12:55
 # @Last Modified by: Haozhe Xie
-# @Last Modified at: 2023-07-18 18:48:16
+# @Last Modified at: 2026-10-15 17:47:37
 # @Email:  root@haozhexie.com
 
 import argparse
@@ -219,9 +219,8 @@ def get_seg_volume_rendering(hf, seg, trajectory):
                 "z": t["camera"]["z"],
             },
         )
-        seg_map = utils.helpers.get_seg_map(voxel_id.squeeze()[..., 0].cpu().numpy())
         frame = utils.helpers.get_diffuse_shading_img(
-            seg_map,
+            utils.helpers.get_seg_map_rgb(voxel_id.squeeze()[..., 0]),
             depth2.squeeze(dim=0).permute(2, 0, 1, 3, 4),
             raydirs.squeeze(dim=0),
             cam_origin.squeeze(dim=0),
@@ -4,7 +4,7 @@
 # @Author: Haozhe Xie
 # @Date:   2023-03-24 20:24:38
 # @Last Modified by: Haozhe Xie
-# @Last Modified at: 2023-06-16 09:55:58
+# @Last Modified at: 2026-10-15 17:39:10
 # @Email:  root@haozhexie.com
 
 import torch
@@ -18,6 +18,12 @@ class TensorExtruder(torch.nn.Module):
         self.max_height = max_height
 
     def forward(self, seg_map, height_field):
+        # NOTE: The CUDA kernel reads and writes int32. The volume cannot be narrowed
+        #       to uint8 since it contains building instance IDs, and voxlib only
+        #       accepts int32 volumes.
+        assert (
+            seg_map.dtype == torch.int32 and height_field.dtype == torch.int32
+        ), "Expected int32 inputs, got %s and %s" % (seg_map.dtype, height_field.dtype)
         assert torch.max(height_field) < self.max_height, "Max Value %d" % torch.max(
             height_field
         )
@@ -4,7 +4,7 @@
 # @Author: Haozhe Xie
 # @Date:   2023-04-05 20:09:04
 # @Last Modified by: Haozhe Xie
-# @Last Modified at: 2024-02-28 16:36:13
+# @Last Modified at: 2026-10-15 17:46:57
 # @Email:  root@haozhexie.com
 # @Ref: https://github.com/CompVis/taming-transformers
 
@@ -46,7 +46,12 @@ class VQAutoEncoder(torch.nn.Module):
     def encode(self, x):
         h = self.encoder(x)
         h = self.quant_conv(h)
-        quant, emb_loss, info = self.quantize(h)
+        # NOTE: The codebook lookup always runs in FP32. Under autocast, the distances
+        #       z^2 + e^2 - 2ze cancel out in low precision and change the argmin.
+        with torch.autocast(device_type=h.device.type, enabled=False):
+            quant, emb_loss, info = self.quantize(h.float())
+        # (B * H * W, ) -> (B, H * W), which is the input of the sampler
+        info["min_encoding_indices"] = info["min_encoding_indices"].view(x.size(0), -1)
         return quant, emb_loss, info
 
     def decode(self, quant):
@@ -4,14 +4,13 @@
 # @Author: Haozhe Xie
 # @Date:   2023-03-31 15:04:25
 # @Last Modified by: Haozhe Xie
-# @Last Modified at: 2024-03-01 10:59:27
+# @Last Modified at: 2026-10-15 17:58:51
 # @Email:  root@haozhexie.com
 
 import argparse
 import cv2
 import json
 import logging
-import matplotlib.pyplot as plt
 import numpy as np
 import os
 import perlin_numpy
@@ -31,8 +30,6 @@ sys.path.append(PROJECT_HOME)
 
 import utils.helpers
 import utils.osm_helper
-import extensions.voxlib
-from extensions.extrude_tensor import TensorExtruder
 
 # Global constants
 HEIGHTS = {
@@ -58,6 +55,31 @@ CONSTANTS = {
     "BLD_INS_LABEL_MIN": 10,
     "MAX_LAYOUT_HEIGHT": 640,
 }
+# The footprint classes are indexes of the colors in FOOTPRINT_COLORS
+FOOTPRINT_CLASSES = {
+    "INNER": 0,
+    "INNER_BUILDING": 1,
+    "ROOF": 2,
+    "BUILDING": 3,
+    "BUILDING_PART": 4,
+    "CONSTRUCTION": 5,
+    "OTHERS": 6,
+}
+FOOTPRINT_COLORS = {
+    "seg_map": (
+        CLASSES["BLD_FACADE"],
+        CLASSES["BLD_FACADE"],
+        CLASSES["BLD_FACADE"],
+        CLASSES["BLD_FACADE"],
+        CLASSES["BLD_FACADE"],
+        CLASSES["CONSTRUCTION"],
+        CLASSES["NULL"],
+    ),
+    "footprint_contour": (0, 1, 1, 1, 0, 0, 0),
+}
+# The structuring elements for removing the outliers in masks
+EROSION_KERNEL = np.ones((5, 5), dtype=np.uint8)
+SMOOTHING_KERNEL = np.ones((7, 7), dtype=np.uint8)
 
 
 def _tag_equals(tags, key, values=None):
@@ -83,37 +105,51 @@ def _get_highway_color(map_name, highway_tags):
         raise Exception("Unknown map name: %s" % map_name)
 
 
+def _classify_footprint(footprint_tags):
+    if _tag_equals(footprint_tags, "role", ["inner"]):
+        return (
+            FOOTPRINT_CLASSES["INNER_BUILDING"]
+            if _tag_equals(footprint_tags, "building")
+            else FOOTPRINT_CLASSES["INNER"]
+        )
+    elif _tag_equals(footprint_tags, "building", ["roof"]):
+        return FOOTPRINT_CLASSES["ROOF"]
+    elif _tag_equals(footprint_tags, "building"):
+        return FOOTPRINT_CLASSES["BUILDING"]
+    elif _tag_equals(footprint_tags, "building:part"):
+        return FOOTPRINT_CLASSES["BUILDING_PART"]
+    elif _tag_equals(footprint_tags, "landuse", ["construction"]):
+        return FOOTPRINT_CLASSES["CONSTRUCTION"]
+    else:
+        return FOOTPRINT_CLASSES["OTHERS"]
+
+
+def _classify_footprints(footprints):
+    # The tags are parsed once here instead of in each call of _get_footprint_color
+    for _, values in footprints.items():
+        tags = values["tags"]
+        tags["_class"] = _classify_footprint(tags)
+        if _tag_equals(tags, "height"):
+            tags["_height"] = int(float(tags["height"]) + 0.5)
+    return footprints
+
+
 def _get_footprint_color(map_name, footprint_tags):
     if map_name == "height_field":
-        if _tag_equals(footprint_tags, "height"):
-            return int(float(footprint_tags["height"]) + 0.5)
-        elif _tag_equals(footprint_tags, "role", ["inner"]):
-            # "role" in footprint_tags and footprint_tags["role"] == "inner"
-            return None
-        elif _tag_equals(footprint_tags, "building", ["roof"]):
-            #  "building" in footprint_tags and footprint_tags["building"] == "roof"
+        if "_height" in footprint_tags:
+            return footprint_tags["_height"]
+        elif footprint_tags["_class"] in [
+            FOOTPRINT_CLASSES["INNER"],
+            FOOTPRINT_CLASSES["INNER_BUILDING"],
+            FOOTPRINT_CLASSES["ROOF"],
+        ]:
             return None
-        elif _tag_equals(footprint_tags, "landuse", ["construction"]):
-            #  "building" in footprint_tags and footprint_tags["building"] == "construction"
+        elif footprint_tags["_class"] == FOOTPRINT_CLASSES["CONSTRUCTION"]:
             return HEIGHTS["CONSTRUCTION"]
         else:
             raise Exception("Unknown height for tag: %s" % footprint_tags)
-    elif map_name == "seg_map":
-        if _tag_equals(footprint_tags, "role", ["inner"]):
-            return CLASSES["BLD_FACADE"]
-        elif _tag_equals(footprint_tags, "building") or _tag_equals(
-            footprint_tags, "building:part"
-        ):
-            return CLASSES["BLD_FACADE"]
-        elif _tag_equals(footprint_tags, "landuse", ["construction"]):
-            return CLASSES["CONSTRUCTION"]
-        else:
-            return CLASSES["NULL"]
-    elif map_name == "footprint_contour":
-        if _tag_equals(footprint_tags, "building"):
-            return 1
-        else:
-            return 0
+    elif map_name in FOOTPRINT_COLORS:
+        return FOOTPRINT_COLORS[map_name][footprint_tags["_class"]]
     else:
         raise Exception("Unknown map name: %s" % map_name)
 
@@ -121,42 +157,53 @@ def _get_footprint_color(map_name, footprint_tags):
 def _remove_mask_outliers(mask):
     N_PIXELS_THRES = 96
     MIN_VAL_THRES = 64
-    mask = cv2.erode(mask, np.ones((5, 5), dtype=np.uint8))
+    mask = cv2.erode(mask, EROSION_KERNEL)
     # Ignore small regions
     _, labels, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=4)
-    ignored_indexes = np.where(stats[:, -1] <= N_PIXELS_THRES)[0]
-    ignored_mask = np.isin(labels, ignored_indexes)
-    mask = mask * ~ignored_mask
+    # Look up the labels to keep, which is O(N) instead of O(NK) for np.isin
+    keep = (stats[:, cv2.CC_STAT_AREA] > N_PIXELS_THRES).astype(np.uint8)
+    mask = _apply_keep_mask(mask, labels, keep)
     # Make the border smoother
     mask = cv2.GaussianBlur(mask, (0, 0), sigmaX=3, sigmaY=3)
-    mask = cv2.dilate(mask, np.ones((7, 7), dtype=np.uint8))
-    mask = cv2.erode(mask, np.ones((7, 7), dtype=np.uint8))
+    mask = cv2.dilate(mask, SMOOTHING_KERNEL)
+    mask = cv2.erode(mask, SMOOTHING_KERNEL)
     mask = cv2.GaussianBlur(mask, (0, 0), sigmaX=1, sigmaY=1)
     # Ignore small regions
     _, labels, stats, _ = cv2.connectedComponentsWithStats(
         (mask >= MIN_VAL_THRES).astype(np.uint8), connectivity=4
     )
-    ignored_indexes = np.where(stats[:, -1] <= N_PIXELS_THRES)[0]
-    ignored_mask = np.isin(labels, ignored_indexes)
-    return mask * ~ignored_mask
+    keep = (stats[:, cv2.CC_STAT_AREA] > N_PIXELS_THRES).astype(np.uint8)
+    return _apply_keep_mask(mask, labels, keep)
+
+
+def _apply_keep_mask(mask, labels, keep):
+    # Gather the keep flags and mask them in place, which avoids the
+    # intermediate arrays of keep[labels] * mask.
+    output = np.take(keep, labels)
+    return np.multiply(output, mask, out=output)
+
 
+def _get_color_mask(tile_img, img_size, lb, ub):
+    # Downsample the tile image before inRange, which is cheaper than resizing
+    # the binary mask and avoids the aliasing of the mask.
+    tile_img = cv2.resize(tile_img, img_size[::-1], interpolation=cv2.INTER_AREA)
+    return cv2.inRange(tile_img, lb, ub)
 
-def get_coast_zones(osm_tile_img_path, img_size):
-    tile_img = cv2.imread(osm_tile_img_path)
+
+def get_coast_zones(tile_img, img_size):
     water_lb = np.array([219, 219, 195], dtype=np.uint8)
     water_ub = np.array([235, 235, 219], dtype=np.uint8)
-    mask = cv2.resize(cv2.inRange(tile_img, water_lb, water_ub), img_size[::-1])
+    mask = _get_color_mask(tile_img, img_size, water_lb, water_ub)
     return _remove_mask_outliers(mask)
 
 
-def get_green_lands(osm_tile_img_path, seg_map):
-    tile_img = cv2.imread(osm_tile_img_path)
+def get_green_lands(tile_img, seg_map):
     green_lb = np.array([209, 217, 217], dtype=np.uint8)
     green_ub = np.array([219, 236, 233], dtype=np.uint8)
     # Only assign green lands to uncategoried pixels
     uncategoried = np.zeros_like(seg_map)
     uncategoried[seg_map == 0] = True
-    mask = cv2.resize(cv2.inRange(tile_img, green_lb, green_ub), seg_map.shape[::-1])
+    mask = _get_color_mask(tile_img, seg_map.shape, green_lb, green_ub)
     return _remove_mask_outliers(mask) * uncategoried
 
 
@@ -174,18 +221,30 @@ def get_osm_images(osm_file_path, osm_tile_img_path, zoom_level):
     )
     nodes = utils.osm_helper.get_nodes_xy_coordinates(nodes, resolution, zoom_level)
     xy_bounds = utils.osm_helper.get_xy_bounds(nodes)
+    # Convert the ways into CSR arrays of node indexes, which are shared by all maps
+    node_indexes, nodes_xy = utils.osm_helper.get_nodes_xy_array(nodes)
+    highways_csr = utils.osm_helper.get_ways_csr(highways, node_indexes)
+    footprints_csr = utils.osm_helper.get_ways_csr(footprints, node_indexes)
 
     # Fix missing height (for buildings) and width for highways
     highways = utils.osm_helper.fix_missing_highway_width(highways)
     footprints = utils.osm_helper.fix_missing_footprint_height(
         footprints, utils.osm_helper.get_footprint_height_stat(footprints)
     )
+    footprints = _classify_footprints(footprints)
 
     # Generate semantic labels
     logging.debug("Generating segmentation maps ...")
     seg_map = utils.osm_helper.get_empty_map(xy_bounds)
     seg_map = utils.osm_helper.plot_highways(
-        "seg_map", _get_highway_color, seg_map, highways, nodes, xy_bounds, resolution
+        "seg_map",
+        _get_highway_color,
+        seg_map,
+        highways,
+        highways_csr,
+        nodes_xy,
+        xy_bounds,
+        resolution,
     )
     # Read coast zones from no-label tile images
     logging.debug("Reading green lands and coast zones from tile images ...")
@@ -197,21 +256,23 @@ def get_osm_images(osm_file_path, osm_tile_img_path, zoom_level):
             % (osm_file_path, osm_tile_img_path)
         )
     else:
-        green_lands = get_green_lands(osm_tile_img_path, seg_map)
-        seg_map[green_lands != 0] = CLASSES["GREEN_LANDS"]
-        coast_zones = get_coast_zones(osm_tile_img_path, seg_map.shape)
-        seg_map[coast_zones != 0] = CLASSES["COAST_ZONES"]
+        tile_img = cv2.imread(osm_tile_img_path)
+        green_lands = get_green_lands(tile_img, seg_map)
+        np.putmask(seg_map, green_lands, CLASSES["GREEN_LANDS"])
+        coast_zones = get_coast_zones(tile_img, seg_map.shape)
+        np.putmask(seg_map, coast_zones, CLASSES["COAST_ZONES"])
 
     seg_map = utils.osm_helper.plot_footprints(
         "seg_map",
         _get_footprint_color,
         seg_map,
         footprints,
-        nodes,
+        footprints_csr,
+        nodes_xy,
         xy_bounds,
     )
     # Assign ID=6 to unlabelled pixels (regarded as ground)
-    seg_map[seg_map == 0] = CLASSES["OTHERS"]
+    np.putmask(seg_map, seg_map == 0, CLASSES["OTHERS"])
 
     # Generate the contours of footprints
     logging.debug("Generating footprint contours ...")
@@ -221,7 +282,8 @@ def get_osm_images(osm_file_path, osm_tile_img_path, zoom_level):
         _get_footprint_color,
         footprint_contour,
         footprints,
-        nodes,
+        footprints_csr,
+        nodes_xy,
         xy_bounds,
         resolution,
     )
@@ -236,15 +298,17 @@ def get_osm_images(osm_file_path, osm_tile_img_path, zoom_level):
     #     _get_highway_color,
     #     height_field,
     #     highways,
-    #     nodes,
+    #     highways_csr,
+    #     nodes_xy,
     #     xy_bounds,
     #     resolution,
     # )
-    height_field[height_field == 0] = HEIGHTS["ROAD"]
+    np.putmask(height_field, height_field == 0, HEIGHTS["ROAD"])
     if coast_zones is not None:
-        height_field[coast_zones != 0] = HEIGHTS["COAST_ZONES"]
+        np.putmask(height_field, coast_zones, HEIGHTS["COAST_ZONES"])
     if green_lands is not None:
-        green_lands[green_lands != 0] = 1
+        # Binarize the mask in place
+        np.minimum(green_lands, 1, out=green_lands)
         # Generate random height field for green lands
         random_hf_shape = (
             np.ceil(np.array(green_lands.shape).astype(float) / 64).astype(int) * 64
@@ -261,7 +325,8 @@ def get_osm_images(osm_file_path, osm_tile_img_path, zoom_level):
         _get_footprint_color,
         height_field,
         footprints,
-        nodes,
+        footprints_csr,
+        nodes_xy,
         xy_bounds,
     )
 
@@ -415,26 +480,53 @@ def get_instance_seg_map(seg_map, contours=None, use_contours=False):
     return seg_map.astype(np.int32), stats[:, :4]
 
 
+@utils.helpers.static_vars(pinned_buffers={})
+def _get_cuda_tensor(name, array):
+    # Copy the array to GPU via a pinned buffer, which is reused across projects
+    # NOTE: The dtype is compared as well. Otherwise, copy_() would silently cast
+    #       the array to the dtype of the previous buffer.
+    array = torch.from_numpy(array)
+    if (
+        name not in _get_cuda_tensor.pinned_buffers
+        or _get_cuda_tensor.pinned_buffers[name][0].size() != array.size()
+        or _get_cuda_tensor.pinned_buffers[name][0].dtype != array.dtype
+    ):
+        _get_cuda_tensor.pinned_buffers[name] = (
+            torch.empty(array.size(), dtype=array.dtype, pin_memory=True),
+            torch.cuda.Event(),
+        )
+
+    pinned_buffer, copy_event = _get_cuda_tensor.pinned_buffers[name]
+    # Wait for the previous asynchronous copy before overwriting the buffer
+    copy_event.synchronize()
+    pinned_buffer.copy_(array)
+    tensor = pinned_buffer.cuda(non_blocking=True)
+    copy_event.record()
+    return tensor
+
+
 def get_seg_volume(part_seg_map, part_hf, tensor_extruder=None):
     if tensor_extruder is None:
+        from extensions.extrude_tensor import TensorExtruder
+
         tensor_extruder = TensorExtruder(CONSTANTS["MAX_LAYOUT_HEIGHT"])
 
+    seg_map = _get_cuda_tensor("seg_map", part_seg_map)
+    height_field = _get_cuda_tensor("height_field", part_hf)
     seg_volume = tensor_extruder(
-        torch.from_numpy(part_seg_map[None, None, ...]).cuda(),
-        torch.from_numpy(part_hf[None, None, ...]).cuda(),
+        seg_map[None, None, ...],
+        height_field[None, None, ...],
     ).squeeze()
     logging.debug("The shape of SegVolume: %s" % (seg_volume.size(),))
     # Change the top-level voxel of the "Building Facade" to "Building Roof"
-    roof_seg_map = part_seg_map.copy()
-    non_roof_msk = part_seg_map <= CONSTANTS["BLD_INS_LABEL_MIN"]
     # Assume the ID of a facade instance is 2k, the corresponding roof instance is 2k - 1.
-    roof_seg_map = roof_seg_map - 1
-    roof_seg_map[non_roof_msk] = 0
+    roof_seg_map = seg_map - 1
+    roof_seg_map[seg_map <= CONSTANTS["BLD_INS_LABEL_MIN"]] = 0
     for rh in range(1, HEIGHTS["ROOF"] + 1):
         seg_volume = seg_volume.scatter_(
             dim=2,
-            index=torch.from_numpy(part_hf[..., None] + rh).long().cuda(),
-            src=torch.from_numpy(roof_seg_map[..., None]).cuda(),
+            index=(height_field[..., None] + rh).long(),
+            src=roof_seg_map[..., None],
         )
 
     return seg_volume
@@ -457,6 +549,8 @@ def get_google_earth_aligned_seg_maps(
     if ge_camera_poses is None:
         return []
 
+    import extensions.voxlib
+
     assert ge_camera_poses is not None
     ge_camera_focal = (
         ge_camera_poses["height"] / 2 / np.tan(np.deg2rad(ge_camera_poses["vfov"]))
@@ -484,6 +578,8 @@ def get_google_earth_aligned_seg_maps(
             ),
         )
     )
+    # NOTE: The height field is converted from uint16 to int32. The copy also keeps
+    #       the elevation from being added to height_field.
     part_hf = get_img_patch(
         height_field,
         tr_cx,
@@ -492,12 +588,13 @@ def get_google_earth_aligned_seg_maps(
     ).astype(np.int32)
     # Consider the elevation of the local area
     part_hf += ge_camera_poses["elevation"]
+    # The instance segmentation map is already int32. Therefore, a view is returned.
     part_seg_map = get_img_patch(
         ins_seg_map,
         tr_cx,
         tr_cy,
         patch_size,
-    ).astype(np.int32)
+    ).astype(np.int32, copy=False)
     # Recalculate the center offsets of buildings
     buildings = np.unique(part_seg_map[part_seg_map > CONSTANTS["BLD_INS_LABEL_MIN"]])
     part_building_stats = {}
@@ -516,19 +613,44 @@ def get_google_earth_aligned_seg_maps(
     # Convert camera position to the voxel coordinate system
     seg_maps = []
     vol_cx, vol_cy = ((patch_size - 1) // 2, (patch_size - 1) // 2)
-    for gcp in tqdm(ge_camera_poses["poses"], desc="Project: %s" % ge_project_name):
-        x, y = utils.osm_helper.lnglat2xy(
-            gcp["coordinate"]["longitude"],
-            gcp["coordinate"]["latitude"],
-            metadata["resolution"],
-            zoom_level,
-            dtype=float,
+    n_poses = len(ge_camera_poses["poses"])
+    xs, ys = utils.osm_helper.lnglat2xy_batch(
+        np.fromiter(
+            (gcp["coordinate"]["longitude"] for gcp in ge_camera_poses["poses"]),
+            dtype=np.float64,
+            count=n_poses,
+        ),
+        np.fromiter(
+            (gcp["coordinate"]["latitude"] for gcp in ge_camera_poses["poses"]),
+            dtype=np.float64,
+            count=n_poses,
+        ),
+        metadata["resolution"],
+        zoom_level,
+        dtype=float,
+    )
+    xs -= metadata["bounds"]["xmin"]
+    ys -= metadata["bounds"]["ymin"]
+    zs = np.fromiter(
+        (gcp["coordinate"]["altitude"] for gcp in ge_camera_poses["poses"]),
+        dtype=np.float64,
+        count=n_poses,
+    )
+    for gcp, x, y, z in zip(ge_camera_poses["poses"], xs, ys, zs):
+        gcp["position"] = {"x": x, "y": y, "z": z}
+
+    # NOTE: The camera parameters are kept on CPU since voxlib copies them to CPU
+    #       to set up the kernel. CUDA tensors would cause a sync for each frame.
+    cam_origins = torch.from_numpy(
+        np.stack([ys - tr_cy + vol_cy, xs - tr_cx + vol_cx, zs], axis=1).astype(
+            np.float32
         )
-        gcp["position"] = {
-            "x": x - metadata["bounds"]["xmin"],
-            "y": y - metadata["bounds"]["ymin"],
-            "z": gcp["coordinate"]["altitude"],
-        }
+    )
+    viewdirs = torch.from_numpy(
+        np.stack([cy - ys, cx - xs, -zs], axis=1).astype(np.float32)
+    )
+    cam_up = torch.tensor([0, 0, 1], dtype=torch.float32)
+    for idx in tqdm(range(n_poses), desc="Project: %s" % ge_project_name):
         # Run ray-voxel intersection
         r"""Ray-voxel intersection CUDA kernel.
         Note: voxel_id = 0 and depth2 = NaN if there is no intersection along the ray
@@ -550,24 +672,8 @@ def get_google_earth_aligned_seg_maps(
 
         """
         N_MAX_SAMPLES = 6
-        cam_origin = torch.tensor(
-            [
-                gcp["position"]["y"] - tr_cy + vol_cy,
-                gcp["position"]["x"] - tr_cx + vol_cx,
-                gcp["position"]["z"],
-            ],
-            dtype=torch.float32,
-            device=seg_volume.device,
-        )
-        viewdir = torch.tensor(
-            [
-                cy - gcp["position"]["y"],
-                cx - gcp["position"]["x"],
-                -gcp["position"]["z"],
-            ],
-            dtype=torch.float32,
-            device=seg_volume.device,
-        )
+        cam_origin = cam_origins[idx]
+        viewdir = viewdirs[idx]
         (
             voxel_id,
             depth2,
@@ -576,7 +682,7 @@ def get_google_earth_aligned_seg_maps(
             seg_volume,
             cam_origin,
             viewdir,
-            torch.tensor([0, 0, 1], dtype=torch.float32),
+            cam_up,
             # The MAGIC NUMBER to make it aligned with Google Earth Renderings
             ge_camera_focal * 2.06,
             [
@@ -588,12 +694,12 @@ def get_google_earth_aligned_seg_maps(
         )
         # print(voxel_id.size())    # torch.Size([540, 960, 10, 1])
         if debug:
-            seg_map = utils.helpers.get_seg_map(
-                voxel_id.squeeze()[..., 0].cpu().numpy()
-            )
             seg_maps.append(
                 utils.helpers.get_diffuse_shading_img(
-                    seg_map, depth2, raydirs, cam_origin
+                    utils.helpers.get_seg_map_rgb(voxel_id[..., 0, 0]),
+                    depth2,
+                    raydirs,
+                    cam_origin.to(raydirs.device),
                 )
             )
         else:
@@ -602,8 +708,8 @@ def get_google_earth_aligned_seg_maps(
                     "voxel_id": voxel_id.cpu().numpy(),
                     "depth2": depth2.permute(1, 2, 0, 3, 4).cpu().numpy(),
                     "raydirs": raydirs.cpu().numpy(),
-                    "viewdir": viewdir.cpu().numpy(),
-                    "cam_origin": cam_origin.cpu().numpy(),
+                    "viewdir": viewdir.numpy(),
+                    "cam_origin": cam_origin.numpy(),
                     "img_center": {"cx": tr_cx, "cy": tr_cy},
                 }
             )
@@ -636,6 +742,10 @@ def main(
     else:
         osm_files = sorted([f for f in os.listdir(osm_out_dir)])
 
+    # NOTE: The CUDA extensions are imported on demand so that the rasterization
+    #       functions can be imported without them.
+    from extensions.extrude_tensor import TensorExtruder
+
     tensor_extruder = TensorExtruder(max_height)
     for of in tqdm(osm_files):
         basename, _ = os.path.splitext(of)
@@ -664,9 +774,20 @@ def main(
                 os.path.join(_osm_out_dir, "tiles.png"),
                 zoom_level,
             )
-            Image.fromarray(height_field).save(output_hf_file_path)
-            # Image.fromarray(contours).save(output_ctr_file_path)
-            utils.helpers.get_seg_map(seg_map).save(output_seg_map_file_path)
+            # NOTE: OpenCV writes 16-bit PNGs directly. The fast compression level
+            #       trades a slightly larger file for much less CPU time.
+            cv2.imwrite(
+                output_hf_file_path, height_field, [cv2.IMWRITE_PNG_COMPRESSION, 1]
+            )
+            # cv2.imwrite(
+            #     output_ctr_file_path,
+            #     contours.astype(np.uint8) * 255,
+            #     [cv2.IMWRITE_PNG_COMPRESSION, 1],
+            # )
+            # The semantic classes are saved as an 8-bit palette PNG
+            utils.helpers.get_seg_map(seg_map).save(
+                output_seg_map_file_path, compress_level=1
+            )
             with open(metadata_file_path, "w") as f:
                 json.dump(metadata, f)
 
@@ -717,6 +838,8 @@ def main(
 
 
 if __name__ == "__main__":
+    import matplotlib.pyplot as plt
+
     plt.rcParams["figure.figsize"] = (36, 36)
     logging.basicConfig(
         filename=os.path.join(PROJECT_HOME, "output", "dataset-generator.log"),
@@ -4,59 +4,148 @@
 # @Author: Haozhe Xie
 # @Date:   2023-04-04 14:46:29
 # @Last Modified by: Haozhe Xie
-# @Last Modified at: 2023-04-06 11:06:03
+# @Last Modified at: 2026-10-15 17:38:57
 # @Email:  root@haozhexie.com
 
 import argparse
+import concurrent.futures
 import cv2
+import functools
 import logging
 import numpy as np
 import os
 import requests
-import shutil
+import requests.adapters
 import sys
 import time
+import urllib3.util.retry
 
 from tqdm import tqdm
 
 OSM_TILE_SIZE = 256
+N_MAX_WORKERS = 16
+N_MAX_RETRIES = 5
+# The interval between two requests of the same worker (in seconds)
+REQUEST_INTERVAL = 0.05
+REQUEST_TIMEOUT = 30
+PNG_MAGIC_NUMBER = b"\x89PNG\r\n\x1a\n"
+# The tiles are shared by all OSMs with the same zoom level
+TILE_CACHE_DIR = os.environ.get("OSM_TILE_CACHE", "/tmp/osm-image-fetcher")
 PROJECT_HOME = os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir))
 sys.path.append(PROJECT_HOME)
 
 import utils.osm_helper
 
 
-def get_tile_img(zoom, x, y):
-    WORK_DIR = "/tmp/osm-image-fetcher"
+def get_session():
+    session = requests.Session()
+    session.headers.update(
+        {
+            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/111.0.0.0 Safari/537.36",
+        }
+    )
+    # Reuse the connections among the workers
+    session.mount(
+        "https://",
+        requests.adapters.HTTPAdapter(
+            pool_connections=N_MAX_WORKERS,
+            pool_maxsize=N_MAX_WORKERS,
+            max_retries=urllib3.util.retry.Retry(total=3, backoff_factor=0.3),
+        ),
+    )
+    return session
+
+
+@functools.lru_cache(maxsize=1024)
+def _get_cached_tile_img(img_file_path):
+    tile_img = cv2.imread(img_file_path)
+    if tile_img is None:
+        # Raise an exception so that the failure is not cached
+        raise Exception("Failed to read the tile image: %s" % img_file_path)
+
+    # The cached images are shared by the adjacent OSMs
+    tile_img.setflags(write=False)
+    return tile_img
+
+
+def _download_tile_img(session, url, img_file_path):
+    part_file_path = img_file_path + ".part"
+    try:
+        with session.get(url, stream=True, timeout=REQUEST_TIMEOUT) as response:
+            if response.status_code != 200:
+                raise Exception(
+                    "Failed to fetch %s: HTTP %d" % (url, response.status_code)
+                )
+            with open(part_file_path, "wb") as f:
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    f.write(chunk)
+
+        # Make sure that the response is a PNG image instead of an error page
+        with open(part_file_path, "rb") as f:
+            if f.read(len(PNG_MAGIC_NUMBER)) != PNG_MAGIC_NUMBER:
+                raise Exception("Invalid PNG image fetched from %s" % url)
+
+        os.replace(part_file_path, img_file_path)
+    finally:
+        if os.path.exists(part_file_path):
+            os.remove(part_file_path)
+        time.sleep(REQUEST_INTERVAL)
+
+
+def get_tile_img(session, zoom, x, y):
     url = (
         "https://a.basemaps.cartocdn.com/rastertiles/voyager_nolabels/%d/%d/%d.png"
         % (zoom, x, y)
     )
-    img_file_path = os.path.join(WORK_DIR, "z%d-x%d-y%d.png" % (zoom, x, y))
-    os.makedirs(WORK_DIR, exist_ok=True)
-    response = None
-    if not os.path.exists(img_file_path):
-        try:
-            session = requests.Session()
-            session.headers.update(
-                {
-                    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/111.0.0.0 Safari/537.36",
-                }
-            )
-            response = session.get(url, stream=True)
-            with open(img_file_path, "wb") as f:
-                shutil.copyfileobj(response.raw, f)
-        except Exception as ex:
-            logging.exception(ex)
-        finally:
-            del response
-            time.sleep(0.5)
-
-    return cv2.imread(img_file_path)
+    img_file_path = os.path.join(TILE_CACHE_DIR, "z%d-x%d-y%d.png" % (zoom, x, y))
+    os.makedirs(TILE_CACHE_DIR, exist_ok=True)
+    # Empty files are left by the failed downloads of the previous versions
+    if not os.path.exists(img_file_path) or os.path.getsize(img_file_path) == 0:
+        _download_tile_img(session, url, img_file_path)
+
+    try:
+        return _get_cached_tile_img(img_file_path)
+    except Exception:
+        # Remove the broken image so that it is fetched again in the next retry
+        os.remove(img_file_path)
+        raise
+
+
+def get_tile_imgs(session, zoom, tl_img_idx, br_img_idx):
+    tile_imgs = {}
+    n_retries = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=N_MAX_WORKERS) as executor:
+        futures = {
+            executor.submit(get_tile_img, session, zoom, i, j): (i, j)
+            for i in range(tl_img_idx["x"], br_img_idx["x"] + 1)
+            for j in range(tl_img_idx["y"], br_img_idx["y"] + 1)
+        }
+        while futures:
+            for future in concurrent.futures.as_completed(list(futures.keys())):
+                i, j = futures.pop(future)
+                try:
+                    tile_imgs[(i, j)] = future.result()
+                except Exception as ex:
+                    n_retries[(i, j)] = n_retries.get((i, j), 0) + 1
+                    if n_retries[(i, j)] > N_MAX_RETRIES:
+                        logging.error(
+                            "Failed to fetch the tile[Zoom=%d, X=%d, Y=%d]: %s"
+                            % (zoom, i, j, ex)
+                        )
+                        continue
+
+                    logging.warning(
+                        "Retrying the tile[Zoom=%d, X=%d, Y=%d] (%d/%d): %s"
+                        % (zoom, i, j, n_retries[(i, j)], N_MAX_RETRIES, ex)
+                    )
+                    futures[executor.submit(get_tile_img, session, zoom, i, j)] = (i, j)
+
+    return tile_imgs
 
 
 def main(osm_dir, zoom_level):
     osm_files = sorted([f for f in os.listdir(osm_dir) if f.endswith(".osm")])
+    session = get_session()
     for of in tqdm(osm_files):
         basename, _ = os.path.splitext(of)
         osm_file_path = os.path.join(osm_dir, of)
@@ -88,20 +177,19 @@ def main(osm_dir, zoom_level):
         height = n_y_imgs * OSM_TILE_SIZE
         logging.debug("The number of images to fetch: %dx%d" % (n_x_imgs, n_y_imgs))
 
-        osm_img = np.zeros((height, width, 3), dtype=np.uint8)
-        for i in range(tl_img_idx["x"], br_img_idx["x"] + 1):
-            for j in range(tl_img_idx["y"], br_img_idx["y"] + 1):
-                offset_x = (i - tl_img_idx["x"]) * OSM_TILE_SIZE
-                offset_y = (j - tl_img_idx["y"]) * OSM_TILE_SIZE
-                osm_img_patch = None
-                while osm_img_patch is None:
-                    osm_img_patch = get_tile_img(zoom_level, i, j)
-
-                osm_img[
-                    offset_y : offset_y + OSM_TILE_SIZE,
-                    offset_x : offset_x + OSM_TILE_SIZE,
-                    :,
-                ] = osm_img_patch
+        tile_imgs = get_tile_imgs(session, zoom_level, tl_img_idx, br_img_idx)
+        # The mosaic is laid out as (n_y_imgs, H, n_x_imgs, W, C), which is reshaped
+        # into an image without copying. Each tile is copied only once.
+        osm_img = np.empty(
+            (n_y_imgs, OSM_TILE_SIZE, n_x_imgs, OSM_TILE_SIZE, 3), dtype=np.uint8
+        )
+        for j in range(n_y_imgs):
+            for i in range(n_x_imgs):
+                tile_img = tile_imgs.get((tl_img_idx["x"] + i, tl_img_idx["y"] + j))
+                # Only the tiles that failed to fetch are filled with zeros
+                osm_img[j, :, i] = 0 if tile_img is None else tile_img
+
+        osm_img = osm_img.reshape(height, width, 3)
         # Crop the image
         tl_offset = {
             "x": bounds["xmin"] - tl_img_idx["x"] * OSM_TILE_SIZE,
@@ -122,8 +210,11 @@ def main(osm_dir, zoom_level):
             and br_offset["y"] >= -256
             and br_offset["y"] <= 0
         )
+        # NOTE: The end indexes are relative to the top left so that zero BR
+        #       offsets keep the last row/column.
         osm_img = osm_img[
-            tl_offset["y"] : br_offset["y"], tl_offset["x"] : br_offset["x"]
+            tl_offset["y"] : height + br_offset["y"],
+            tl_offset["x"] : width + br_offset["x"],
         ]
         # Save the image
         cv2.imwrite(os.path.join(_osm_dir, "tiles.png"), osm_img)
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+#
+# @File:   vqae_code_generator.py
+# @Author: Haozhe Xie
+# @Date:   2026-10-15 17:20:43
+# @Last Modified by: Haozhe Xie
+# @Last Modified at: 2026-10-15 17:47:10
+# @Email:  root@haozhexie.com
+
+import argparse
+import logging
+import numpy as np
+import os
+import sys
+import torch
+
+from tqdm import tqdm
+
+PROJECT_HOME = os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir))
+sys.path.append(PROJECT_HOME)
+
+import models.vqgan
+import utils.datasets
+import utils.helpers
+
+
+def get_vqae(ckpt):
+    vqae = models.vqgan.VQAutoEncoder(ckpt["cfg"])
+    vqae.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    vqae = vqae.to(vqae.device)
+    # The checkpoints are saved from the DDP-wrapped models
+    torch.nn.modules.utils.consume_prefix_in_state_dict_if_present(
+        ckpt["vqae"], "module."
+    )
+    vqae.load_state_dict(ckpt["vqae"])
+    vqae.eval()
+    return vqae
+
+
+def main(ckpt_file_path, osm_dir, output_file, batch_size, n_workers):
+    logging.info("Recovering from %s ..." % ckpt_file_path)
+    ckpt = torch.load(ckpt_file_path, map_location="cpu")
+    cfg = ckpt["cfg"]
+    if osm_dir is not None:
+        cfg.DATASETS.OSM_LAYOUT.DIR = osm_dir
+
+    vqae = get_vqae(ckpt)
+    # NOTE: The random crops and flips of the training set are frozen into the
+    # generated codes. Each city is sampled N_REPEAT times.
+    dataset = utils.datasets.get_dataset(cfg, "OSM_LAYOUT", "train")
+    data_loader = torch.utils.data.DataLoader(
+        dataset=dataset,
+        batch_size=batch_size,
+        num_workers=n_workers,
+        collate_fn=utils.datasets.collate_fn,
+        pin_memory=True,
+        shuffle=False,
+    )
+    # The codebook indexes are smaller than N_EMBED, which fit in int16.
+    assert cfg.NETWORK.VQGAN.N_EMBED <= np.iinfo(np.int16).max
+    codes = np.empty(
+        (len(dataset), cfg.NETWORK.VQGAN.ATTN_RESOLUTION**2), dtype=np.int16
+    )
+    n_samples = 0
+    for data in tqdm(data_loader):
+        input = utils.helpers.var_or_cuda(data["img"], vqae.device)
+        # NOTE: The same precision as the sampler training, where the encoder runs
+        #       in BF16 and the quantizer runs in FP32.
+        with torch.no_grad(), torch.autocast(
+            device_type=vqae.device.type,
+            dtype=torch.bfloat16,
+            enabled=torch.cuda.is_available(),
+        ):
+            _, _, info = vqae.encode(input)
+
+        bs = input.size(0)
+        codes[n_samples : n_samples + bs] = info["min_encoding_indices"].cpu().numpy()
+        n_samples += bs
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+    np.save(output_file, codes)
+    logging.info("Saved %d codes to %s" % (n_samples, output_file))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        format="[%(levelname)s] %(asctime)s %(message)s",
+        level=logging.INFO,
+    )
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--ckpt", default=os.path.join(PROJECT_HOME, "output", "vqgan.pth")
+    )
+    parser.add_argument("--osm_dir", default=None)
+    parser.add_argument(
+        "--output_file", default=os.path.join(PROJECT_HOME, "data", "osm-codes.npy")
+    )
+    parser.add_argument("--batch_size", default=32, type=int)
+    parser.add_argument("--n_workers", default=8, type=int)
+    args = parser.parse_args()
+    main(args.ckpt, args.osm_dir, args.output_file, args.batch_size, args.n_workers)
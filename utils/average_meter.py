@@ -4,7 +4,7 @@
 # @Author: Haozhe Xie
 # @Date:   2019-08-06 22:50:12
 # @Last Modified by: Haozhe Xie
-# @Last Modified at: 2023-04-06 10:07:14
+# @Last Modified at: 2026-10-15 17:58:14
 # @Email:  root@haozhexie.com
 
 
@@ -27,37 +27,55 @@ class AverageMeter(object):
                 self._val[idx] = v
                 self._sum[idx] += v * weight
                 self._count[idx] += weight
+        elif type(values).__name__ == "Tensor" and values.dim() == 1:
+            # The values are kept on the device to avoid synchronizations. The
+            # weight can be a tensor as well, e.g., zero for the skipped steps.
+            # They are copied to CPU only when val(), count() or avg() is called.
+            self._val = values
+            if type(self._sum).__name__ == "list":
+                self._sum = values * weight
+                self._count = values.new_zeros(self.n_items) + weight
+            else:
+                self._sum.add_(values * weight)
+                self._count.add_(weight)
         else:
             self._val[0] = values
             self._sum[0] += values * weight
             self._count[0] += weight
 
+    def _to_list(self, values):
+        return values.tolist() if type(values).__name__ == "Tensor" else values
+
     def val(self, idx=None):
+        _val = self._to_list(self._val)
         if idx is None:
             return (
-                self._val[0]
+                _val[0]
                 if self.items is None
-                else [self._val[i] for i in range(self.n_items)]
+                else [_val[i] for i in range(self.n_items)]
             )
         else:
-            return self._val[idx]
+            return _val[idx]
 
     def count(self, idx=None):
+        _count = self._to_list(self._count)
         if idx is None:
             return (
-                self._count[0]
+                _count[0]
                 if self.items is None
-                else [self._count[i] for i in range(self.n_items)]
+                else [_count[i] for i in range(self.n_items)]
             )
         else:
-            return self._count[idx]
+            return _count[idx]
 
     def avg(self, idx=None):
+        _sum = self._to_list(self._sum)
+        _count = self._to_list(self._count)
         if idx is None:
             return (
-                self._sum[0] / self._count[0]
+                _sum[0] / _count[0]
                 if self.items is None
-                else [self._sum[i] / self._count[i] for i in range(self.n_items)]
+                else [_sum[i] / _count[i] for i in range(self.n_items)]
             )
         else:
-            return self._sum[idx] / self._count[idx]
+            return _sum[idx] / _count[idx]
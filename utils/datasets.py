@@ -4,7 +4,7 @@
 # @Author: Haozhe Xie
 # @Date:   2023-04-06 10:29:53
 # @Last Modified by: Haozhe Xie
-# @Last Modified at: 2024-01-09 18:37:49
+# @Last Modified at: 2026-10-15 17:47:20
 # @Email:  root@haozhexie.com
 
 import numpy as np
@@ -21,6 +21,8 @@ from tqdm import tqdm
 def get_dataset(cfg, dataset_name, split):
     if dataset_name == "OSM_LAYOUT":
         return OsmLayoutDataset(cfg, split)
+    elif dataset_name == "OSM_LAYOUT_CODES":
+        return OsmLayoutCodeDataset(cfg, split)
     elif dataset_name == "GOOGLE_EARTH":
         return GoogleEarthDataset(cfg, split)
     elif dataset_name == "GOOGLE_EARTH_BUILDING":
@@ -78,7 +80,16 @@ class OsmLayoutDataset(torch.utils.data.Dataset):
 
         img = self.transforms(data)
         img = torch.cat([data[f["name"]] for f in self.fields], dim=0)
-        return {"img": img}
+        if self.split == "train":
+            return {"img": img}
+
+        # The class indexes of the one-hot segmentation map, used by the CE loss.
+        # NOTE: The labels are stored in uint8 to reduce the H2D copy, which are
+        #       converted to int64 on the device.
+        return {
+            "img": img,
+            "seg_label": torch.argmax(data["seg"], dim=0).to(torch.uint8),
+        }
 
     def _get_cities(self, cfg, split):
         cities = sorted(os.listdir(cfg.DATASETS.OSM_LAYOUT.DIR))
@@ -173,6 +184,27 @@ class OsmLayoutDataset(torch.utils.data.Dataset):
             )
 
 
+class OsmLayoutCodeDataset(torch.utils.data.Dataset):
+    # The codebook indexes of OSM layouts generated by scripts/vqae_code_generator.py
+    def __init__(self, cfg, split):
+        super(OsmLayoutCodeDataset, self).__init__()
+        self.cfg = cfg
+        self.split = split
+        self.codes = utils.io.IO.get(cfg.DATASETS.OSM_LAYOUT_CODES.FILE_PATH)
+        if self.codes is None:
+            raise Exception(
+                "Failed to read the codebook indexes from %s. Please generate them "
+                "with scripts/vqae_code_generator.py first."
+                % cfg.DATASETS.OSM_LAYOUT_CODES.FILE_PATH
+            )
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, idx):
+        return {"codes": torch.from_numpy(self.codes[idx])}
+
+
 class GoogleEarthDataset(torch.utils.data.Dataset):
     def __init__(self, cfg, split):
         super(GoogleEarthDataset, self).__init__()
@@ -4,7 +4,7 @@
 # @Author: Haozhe Xie
 # @Date:   2023-04-06 10:25:10
 # @Last Modified by: Haozhe Xie
-# @Last Modified at: 2023-07-15 13:28:13
+# @Last Modified at: 2026-10-15 17:47:37
 # @Email:  root@haozhexie.com
 
 import numpy as np
@@ -57,13 +57,13 @@ def get_seg_map_palette():
     return palatte
 
 
-@static_vars(palatte=get_seg_map_palette())
+@static_vars(palatte=get_seg_map_palette().astype(np.uint8).tobytes())
 def get_seg_map(seg_map):
     if np.max(seg_map) >= 7:
         return get_ins_seg_map(seg_map)
 
     seg_map = Image.fromarray(seg_map.astype(np.uint8))
-    seg_map.putpalette(get_seg_map.palatte.reshape(-1).tolist())
+    seg_map.putpalette(get_seg_map.palatte)
     return seg_map
 
 
@@ -92,8 +92,23 @@ def get_ins_seg_map(seg_map):
     return Image.fromarray(seg_map_rgb)
 
 
-def get_diffuse_shading_img(seg_map, depth2, raydirs, cam_origin):
-    mc_rgb = np.array(seg_map.convert("RGB"))
+@static_vars(palattes={})
+def get_seg_map_rgb(seg_map):
+    # The tensor version of get_seg_map, where the colors are looked up on the
+    # device of seg_map. The first 7 colors of the instance palette are the same
+    # as those in the semantic palette. Therefore, it works for both cases.
+    device = seg_map.device
+    if device not in get_seg_map_rgb.palattes:
+        get_seg_map_rgb.palattes[device] = torch.from_numpy(
+            get_ins_seg_map.palatte.astype(np.uint8)
+        ).to(device)
+
+    return get_seg_map_rgb.palattes[device][seg_map.long()]
+
+
+def get_diffuse_shading_img(seg_map_rgb, depth2, raydirs, cam_origin):
+    # seg_map_rgb is the uint8 RGB tensor returned by get_seg_map_rgb(), which is on
+    # the same device as raydirs. Only the shaded image is copied back to the host.
     # Diffused shading, co-located light.
     first_intersection_depth = depth2[0, :, :, 0, None, :]
     first_intersection_point = (
@@ -111,10 +126,8 @@ def get_diffuse_shading_img(seg_map, depth2, raydirs, cam_origin):
     fip_normal = lut[fip_wall_orientation]
     diffuse_shade = torch.abs(torch.sum(fip_normal * raydirs, dim=-1))
 
-    mc_rgb = mc_rgb.astype(float) / 255
-    mc_rgb = mc_rgb * diffuse_shade.cpu().numpy()
-    mc_rgb = (mc_rgb ** (1 / 2.2)) * 255
-    return Image.fromarray(mc_rgb.astype(np.uint8))
+    mc_rgb = (seg_map_rgb / 255 * diffuse_shade).clamp_(0, 1).pow_(1 / 2.2) * 255
+    return Image.fromarray(mc_rgb.to(torch.uint8).cpu().numpy())
 
 
 def masks_to_onehots(masks, n_class, ignored_classes=[]):
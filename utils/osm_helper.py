@@ -4,7 +4,7 @@
 # @Author: Haozhe Xie
 # @Date:   2023-03-21 16:16:06
 # @Last Modified by: Haozhe Xie
-# @Last Modified at: 2024-02-28 18:35:22
+# @Last Modified at: 2026-10-15 17:59:00
 # @Email:  root@haozhexie.com
 
 import cv2
@@ -12,12 +12,26 @@ import logging
 import lxml.etree
 import math
 import numpy as np
+import os
+import pickle
 import re
 
+# NOTE: Bump the version whenever the extracted features are changed so that the
+#       stale caches of get_highways_and_footprints() are no longer used.
+FEATURES_CACHE_VERSION = 1
+
 
 def get_lnglat_bounds(xml_file_path):
-    root = lxml.etree.parse(xml_file_path)
-    bounds = root.find("bounds")
+    # The bounds are at the beginning of the file. Therefore, the parsing stops
+    # at the first <bounds> instead of building the tree of the whole file.
+    bounds = None
+    with open(xml_file_path, "rb") as f:
+        for _, bounds in lxml.etree.iterparse(f, tag="bounds"):
+            break
+
+    if bounds is None:
+        raise Exception("No <bounds> found in the OSM file: %s" % xml_file_path)
+
     return {
         "minlat": bounds.get("minlat"),
         "maxlat": bounds.get("maxlat"),
@@ -47,7 +61,18 @@ def get_xy_bounds(nodes):
     }
 
 
-def get_highways_and_footprints(osm_file_path):
+def get_highways_and_footprints(osm_file_path, use_cache=True):
+    # The parsed results are cached in a sidecar file, which is valid until the
+    # OSM file is modified or the cache version is changed.
+    cache_file_path = "%s.features-v%d.pkl" % (osm_file_path, FEATURES_CACHE_VERSION)
+    if (
+        use_cache
+        and os.path.exists(cache_file_path)
+        and os.path.getmtime(cache_file_path) >= os.path.getmtime(osm_file_path)
+    ):
+        with open(cache_file_path, "rb") as f:
+            return pickle.load(f)
+
     highways, nodes = get_highways(
         osm_file_path,
         [
@@ -79,6 +104,14 @@ def get_highways_and_footprints(osm_file_path):
         nodes,
     )
     nodes = get_nodes_lng_lat(osm_file_path, nodes)
+    if use_cache:
+        try:
+            with open(cache_file_path + ".tmp", "wb") as f:
+                pickle.dump((highways, footprints, nodes), f)
+            os.replace(cache_file_path + ".tmp", cache_file_path)
+        except OSError as ex:
+            logging.warning("Failed to cache the OSM features: %s" % ex)
+
     return highways, footprints, nodes
 
 
@@ -269,6 +302,15 @@ def lnglat2xy(lng, lat, resolution, zoom_level, tile_size=256, dtype=int):
     return (dtype(x * resolution), dtype(y * resolution))
 
 
+def lnglat2xy_batch(lngs, lats, resolution, zoom_level, tile_size=256, dtype=int):
+    # The vectorized version of lnglat2xy for the arrays of longitudes and latitudes
+    n = 2.0**zoom_level
+    xs = (lngs + 180.0) / 360.0 * n * tile_size
+    ys = (1.0 - np.arcsinh(np.tan(np.radians(lats))) / np.pi) / 2.0 * n * tile_size
+    # NOTE: int() truncates towards zero, which is the same as astype(int)
+    return (xs * resolution).astype(dtype), (ys * resolution).astype(dtype)
+
+
 def get_nodes_xy_coordinates(nodes, resolution, zoom_level):
     for _, values in nodes.items():
         if "lng" not in values or "lat" not in values:
@@ -280,6 +322,38 @@ def get_nodes_xy_coordinates(nodes, resolution, zoom_level):
     return nodes
 
 
+def get_nodes_xy_array(nodes):
+    # Store the XY coordinates of nodes in an array, where the row of each node
+    # is indexed by node_indexes. Nodes without coordinates are skipped.
+    nodes = [v for v in nodes.values() if "x" in v and "y" in v]
+    node_indexes = {n["nid"]: i for i, n in enumerate(nodes)}
+    nodes_xy = np.fromiter(
+        (v for n in nodes for v in (n["x"], n["y"])),
+        dtype=np.int32,
+        count=len(nodes) * 2,
+    ).reshape(-1, 2)
+    return node_indexes, nodes_xy
+
+
+def get_ways_csr(ways, node_indexes):
+    # The nodes of the i-th way are node_idx[offsets[i] : offsets[i + 1]]
+    node_idx = np.fromiter(
+        (node_indexes[nid] for w in ways.values() for nid in w["nodes"]),
+        dtype=np.int64,
+    )
+    offsets = np.zeros(len(ways) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(w["nodes"]) for w in ways.values()])
+    return offsets, node_idx
+
+
+def _get_ways_xy(ways_csr, nodes_xy, xy_bounds):
+    offsets, node_idx = ways_csr
+    ways_xy = nodes_xy[node_idx] - np.array(
+        [xy_bounds["xmin"], xy_bounds["ymin"]], dtype=np.int32
+    )
+    return [ways_xy[offsets[i] : offsets[i + 1]] for i in range(len(offsets) - 1)]
+
+
 def get_empty_map(xy_bounds, dtype=np.uint8):
     map_img = np.zeros(
         (
@@ -347,21 +421,16 @@ def _get_missing_footprint_height(footprint_tags, footprint_height_stat):
 
 
 def plot_highways(
-    map_name, colormap, map_img, highways, highway_nodes, xy_bounds, resolution
+    map_name, colormap, map_img, highways, highways_csr, nodes_xy, xy_bounds, resolution
 ):
-    for _, values in highways.items():
-        way_nodes = []
-        for nid in values["nodes"]:
-            node = highway_nodes[nid]
-            way_nodes.append(
-                ((node["x"] - xy_bounds["xmin"], node["y"] - xy_bounds["ymin"]))
-            )
+    highways_xy = _get_ways_xy(highways_csr, nodes_xy, xy_bounds)
+    for values, way_xy in zip(highways.values(), highways_xy):
         if values["tags"]["width"] is None:
             continue
 
         cv2.polylines(
             map_img,
-            [np.int32(way_nodes)],
+            [way_xy],
             isClosed=False,
             color=colormap(map_name, values["tags"]),
             thickness=math.floor(values["tags"]["width"] / resolution + 0.5),
@@ -370,21 +439,24 @@ def plot_highways(
 
 
 def plot_footprints(
-    map_name, colormap, map_img, footprints, footprint_nodes, xy_bounds, resolution=None
+    map_name,
+    colormap,
+    map_img,
+    footprints,
+    footprints_csr,
+    nodes_xy,
+    xy_bounds,
+    resolution=None,
 ):
     # For debug
     # for k, v in footprints.items():
     #     v["tags"]["id"] = k
-    footprints = [v for v in footprints.values()]
-    footprints = sorted(footprints, key=lambda v: v["tags"]["height"])
-
-    for values in footprints:
-        way_nodes = []
-        for nid in values["nodes"]:
-            node = footprint_nodes[nid]
-            way_nodes.append(
-                ((node["x"] - xy_bounds["xmin"], node["y"] - xy_bounds["ymin"]))
-            )
+    footprints = list(
+        zip(footprints.values(), _get_ways_xy(footprints_csr, nodes_xy, xy_bounds))
+    )
+    footprints = sorted(footprints, key=lambda v: v[0]["tags"]["height"])
+
+    for values, way_xy in footprints:
         # color is None for ignored footprints
         color = colormap(map_name, values["tags"])
         if color is None:
@@ -392,15 +464,15 @@ def plot_footprints(
         if resolution is None:
             cv2.fillPoly(
                 map_img,
-                [np.int32(way_nodes)],
+                [way_xy],
                 color=color,
             )
         else:
             cv2.polylines(
                 map_img,
-                [np.int32(way_nodes)],
+                [way_xy],
                 isClosed=True,
-                color=colormap(map_name, values["tags"]),
+                color=color,
                 thickness=1,
             )
 